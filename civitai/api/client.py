@@ -1,42 +1,174 @@
-from typing import Literal
-from urllib.parse import urljoin
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Literal, Iterable, Dict, Optional, List
 
+import ijson
 import requests
 
-from ..session import CIVITAI_ROOT
-from ..utils import get_session
+from ..session import CIVITAI_ROOT, CIVITAI_ADAPTER_PREFIX, has_civitai_adapter
+from ..utils import get_shared_session, get_cached_session, get_pooled_adapter, json_loads, LRUCache
 
 ImageSortTyping = Literal['Newest', 'Oldest', 'Most Reactions', 'Most Buzz', 'Most Comments', 'Most Collected']
 PeriodTyping = Literal['Day', 'Week', 'Month', 'Year', 'AllTime']
 
+_POOL_SIZE = 64
+_CACHE_TTL = 3600  # seconds
+
 
 class CivitAIAPIClient:
+    __slots__ = ('_session', '_base', '_mv_cache', '_hash_cache', '_hash_batch_supported')
+
+    _MV_URL = '/api/v1/model-versions/%s'
+    _MV_HASH_URL = '/api/v1/model-versions/by-hash/%s'
+
     def __init__(self, session: requests.Session):
         self._session = session
+        self._base = CIVITAI_ROOT.rstrip('/')
+        # model version metadata is effectively immutable during a run
+        self._mv_cache = LRUCache(maxsize=4096, ttl=_CACHE_TTL)
+        self._hash_cache = LRUCache(maxsize=8192, ttl=_CACHE_TTL)
+        self._hash_batch_supported = True
+        # keep-alive connections to civitai are reused by concurrent lookups,
+        # adapters mounted by the caller are left untouched
+        if not has_civitai_adapter(self._session):
+            self._session.mount(CIVITAI_ADAPTER_PREFIX, get_pooled_adapter(
+                pool_size=_POOL_SIZE, max_retries=5, backoff_factor=0.3,
+                status_forcelist=(429, 500, 502, 503, 504), allowed_methods=('GET',),
+            ))
 
     @classmethod
-    def no_login(cls) -> 'CivitAIAPIClient':
-        return cls(get_session())
+    def no_login(cls, cache_name: Optional[str] = None) -> 'CivitAIAPIClient':
+        if cache_name:
+            return cls(get_cached_session(cache_name))
+        else:
+            # the api client only issues stateless requests, so one session (and its connection pool)
+            # is shared by all the anonymous clients in this process, including the ones used from other threads
+            return cls(get_shared_session())
 
     def _get(self, url, **kwargs):
-        resp = self._session.get(urljoin(CIVITAI_ROOT, url), **kwargs)
-        resp.raise_for_status()
-        return resp.json()
+        resp = self._session.get(self._base + url, **kwargs)
+        if resp.status_code >= 400:
+            resp.raise_for_status()
+        return json_loads(resp.content)
+
+    def _post(self, url, **kwargs):
+        resp = self._session.post(self._base + url, **kwargs)
+        if resp.status_code >= 400:
+            resp.raise_for_status()
+        return json_loads(resp.content)
 
     def get_model_version(self, model_version_id):
-        return self._get(f'/api/v1/model-versions/{model_version_id}')
+        model_version = self._mv_cache.get(model_version_id)
+        if model_version is None:
+            model_version = self._get(self._MV_URL % (model_version_id,))
+            self._mv_cache.set(model_version_id, model_version)
+        return model_version
 
     def get_model_version_by_hash(self, model_hash: str):
-        return self._get(f'/api/v1/model-versions/by-hash/{model_hash}')
+        model_version = self._hash_cache.get(model_hash.lower())
+        if model_version is None:
+            model_version = self._get(self._MV_HASH_URL % (model_hash,))
+            self._hash_cache.set(model_hash.lower(), model_version)
+            if 'id' in model_version:
+                self._mv_cache.set(model_version['id'], model_version)
+        return model_version
+
+    def _get_model_version_by_hash_or_none(self, model_hash: str):
+        try:
+            return self.get_model_version_by_hash(model_hash)
+        except requests.HTTPError as err:
+            if err.response is not None and err.response.status_code == 404:
+                return None
+            raise
+
+    def _get_model_versions_by_hash_batch(self, hashes: List[str]) -> Dict[str, Optional[dict]]:
+        retval = dict.fromkeys(hashes)
+        wanted = {model_hash.lower(): model_hash for model_hash in hashes}
+        for model_version in self._post('/api/v1/model-versions/by-hash', json=hashes):
+            for file in model_version.get('files') or []:
+                for hash_value in (file.get('hashes') or {}).values():
+                    model_hash = wanted.get(str(hash_value).lower())
+                    if model_hash is not None:
+                        retval[model_hash] = model_version
+                        self._hash_cache.set(model_hash.lower(), model_version)
+
+        return retval
+
+    def get_model_versions_by_hashes(self, hashes: Iterable[str], batch_size: int = 100, max_workers: int = 32) \
+            -> Dict[str, Optional[dict]]:
+        # hashes are looked up in batches with the bulk endpoint, falling back to concurrent single lookups
+        # when the endpoint is not available. unknown hashes are mapped to None
+        hashes = list(dict.fromkeys(hashes))
+        retval, missing = {}, []
+        for model_hash in hashes:
+            model_version = self._hash_cache.get(model_hash.lower())
+            if model_version is not None:
+                retval[model_hash] = model_version
+            else:
+                missing.append(model_hash)
+
+        if missing:
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(missing), _POOL_SIZE)) as executor:
+                if self._hash_batch_supported:
+                    batches = [missing[i:i + batch_size] for i in range(0, len(missing), batch_size)]
+                    try:
+                        for batch_result in executor.map(self._get_model_versions_by_hash_batch, batches):
+                            retval.update(batch_result)
+                    except requests.HTTPError as err:
+                        if err.response is not None and err.response.status_code in {404, 405}:
+                            self._hash_batch_supported = False
+                        else:
+                            raise
+
+                if not self._hash_batch_supported:
+                    retval.update(zip(missing, executor.map(self._get_model_version_by_hash_or_none, missing)))
+
+        return {model_hash: retval[model_hash] for model_hash in hashes}
+
+    @classmethod
+    def _images_params(cls, sort: ImageSortTyping, period: PeriodTyping, limit: int, page: int):
+        return {
+            'sort': sort,
+            'period': period,
+            'limit': limit,
+            'page': page,
+        }
 
     def get_images_by_page(self, sort: ImageSortTyping = 'Newest', period: PeriodTyping = 'AllTime',
                            limit: int = 200, page: int = 1):
-        return self._get(
-            '/api/v1/images',
-            params={
-                'sort': sort,
-                'period': period,
-                'limit': limit,
-                'page': page,
-            },
-        )
+        return self._get('/api/v1/images', params=self._images_params(sort, period, limit, page))
+
+    def iter_images_by_page(self, sort: ImageSortTyping = 'Newest', period: PeriodTyping = 'AllTime',
+                            limit: int = 200, page: int = 1):
+        # items are parsed from the body while it is still downloading,
+        # so only one image dict is held in memory at a time
+        with self._session.get(self._base + '/api/v1/images',
+                               params=self._images_params(sort, period, limit, page), stream=True) as resp:
+            resp.raise_for_status()
+            resp.raw.decode_content = True
+            yield from ijson.items(resp.raw, 'items.item', use_float=True)
+
+    def iter_all_images(self, sort: ImageSortTyping = 'Newest', period: PeriodTyping = 'AllTime',
+                        limit: int = 200, concurrency: int = 4):
+        # keep the next pages in flight while the current one is consumed, items are still yielded in page order
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            pending, next_page = deque(), 1
+
+            def _submit():
+                nonlocal next_page
+                pending.append(executor.submit(self.get_images_by_page, sort, period, limit, next_page))
+                next_page += 1
+
+            for _ in range(concurrency):
+                _submit()
+
+            try:
+                while pending:
+                    data = pending.popleft().result()
+                    yield from data['items']
+                    if not data['items'] or not (data.get('metadata') or {}).get('nextPage'):
+                        break
+                    _submit()
+            finally:
+                for future in pending:
+                    future.cancel()
@@ -0,0 +1,60 @@
+import math
+
+import numpy as np
+
+_BASE83 = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~'
+
+_SRGB_VALUES = np.arange(256, dtype=np.float64) / 255.0
+_SRGB_TO_LINEAR = np.where(
+    _SRGB_VALUES <= 0.04045,
+    _SRGB_VALUES / 12.92,
+    ((_SRGB_VALUES + 0.055) / 1.055) ** 2.4,
+)
+
+
+def _base83_encode(value: int, length: int) -> str:
+    return ''.join(_BASE83[value // (83 ** (length - i)) % 83] for i in range(1, length + 1))
+
+
+def _linear_to_srgb(value: float) -> int:
+    value = max(0.0, min(1.0, value))
+    if value <= 0.0031308:
+        return int(value * 12.92 * 255 + 0.5)
+    return int((1.055 * math.pow(value, 1 / 2.4) - 0.055) * 255 + 0.5)
+
+
+def _cos_table(components: int, size: int) -> np.ndarray:
+    return np.cos(np.pi * np.arange(components)[:, None] * np.arange(size)[None, :] / size)
+
+
+def blurhash_encode(image, components_x: int = 4, components_y: int = 4) -> str:
+    # vectorized port of https://github.com/woltapp/blurhash/blob/master/Algorithm.md,
+    # gives the same result as blurhash.encode
+    if not (1 <= components_x <= 9 and 1 <= components_y <= 9):
+        raise ValueError('x and y component counts must be between 1 and 9 inclusive.')
+
+    # image is a (height, width, 3) array of srgb 0-255 values, e.g. np.asarray(rgb_pil_image)
+    pixels = _SRGB_TO_LINEAR[np.asarray(image, dtype=np.uint8)]
+    height, width = pixels.shape[:2]
+
+    # separable dct, (cy, h) x (h, w, 3) -> (cy, w, 3), then x (cx, w) -> (cy, cx, 3)
+    factors = np.tensordot(_cos_table(components_y, height), pixels, axes=(1, 0))
+    factors = np.tensordot(factors, _cos_table(components_x, width), axes=(1, 1)).transpose(0, 2, 1)
+    factors = factors.reshape(-1, 3) * (2.0 / (width * height))
+    factors[0] *= 0.5
+
+    dc, ac = factors[0], factors[1:]
+    dc_value = (_linear_to_srgb(dc[0]) << 16) + (_linear_to_srgb(dc[1]) << 8) + _linear_to_srgb(dc[2])
+
+    max_ac = float(np.abs(ac).max()) if ac.size else 0.0
+    quant_max_ac = int(max(0, min(82, math.floor(max_ac * 166 - 0.5))))
+    ac = ac / ((quant_max_ac + 1) / 166.0)
+    quant_ac = np.clip(np.floor(np.sign(ac) * np.sqrt(np.abs(ac)) * 9.0 + 9.5), 0, 18).astype(np.int64)
+    ac_values = quant_ac[:, 0] * 19 * 19 + quant_ac[:, 1] * 19 + quant_ac[:, 2]
+
+    return ''.join([
+        _base83_encode((components_x - 1) + (components_y - 1) * 9, 1),
+        _base83_encode(quant_max_ac, 1),
+        _base83_encode(dc_value, 4),
+        *(_base83_encode(int(v), 2) for v in ac_values),
+    ])
@@ -1,41 +1,83 @@
+import codecs
 import datetime
 import json
 import logging
+import mmap
 import os
 import re
 import textwrap
+import time
 import uuid
 import warnings
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from enum import IntFlag
-from typing import Optional, List, Union, Tuple, Mapping, Any
-from urllib.parse import urljoin
+from typing import Optional, List, Union, Tuple, Mapping, Any, Dict, TYPE_CHECKING
+from urllib.parse import urljoin, urlsplit
 
-import blurhash
-import markdown2
-import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
 from hbutils.design import SingletonMark
 from hbutils.string import plural_word
-from imgutils.data import load_image
-from imgutils.sd import get_sdmeta_from_image
 from tqdm import tqdm
-from urlobject import URLObject
 
 from .exceptions import SessionError, APIError
 from .image import CivitaiImage
 from .superjs import resp_data_parse, req_data_format, undefined
-from ..session import load_civitai_session, WhoAmI, CIVITAI_ROOT, get_whoami_by_raw_user_info
-from ..utils import CookiesTyping, parse_publish_at
+from ..session import load_civitai_session, mount_civitai_adapter, WhoAmI, CIVITAI_ROOT, get_whoami_by_raw_user_info
+from ..utils import CookiesTyping, parse_publish_at, json_loads, json_dumps, json_dumpb, get_pooled_adapter, LRUCache
 
 try:
     from typing import Literal
 except (ImportError, ModuleNotFoundError):
     from typing_extensions import Literal
 
+if TYPE_CHECKING:
+    from PIL import Image
+
 m_page = SingletonMark('mark_page')
 m_cursor = SingletonMark('mark_cursor')
 m_none = SingletonMark('mark_none')
 
+# fetches the next page of the iterators while the current one is consumed, for clients created with prefetch=True
+_PREFETCH_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix='civitai_prefetch')
+
+
+class _LazyCall:
+    # same interface as the prefetch futures, but the page is only fetched when it is asked for
+    def __init__(self, fn, *args):
+        self._fn, self._args = fn, args
+
+    def result(self):
+        return self._fn(*self._args)
+
+    def cancel(self) -> bool:
+        return True
+
+
+def _schedule(prefetch: bool, fn, *args):
+    return _PREFETCH_EXECUTOR.submit(fn, *args) if prefetch else _LazyCall(fn, *args)
+
+
+class _InlineExecutor:
+    # executor interface for max_workers=1, every call runs in the calling thread when its result is asked for
+    def submit(self, fn, *args):
+        return _LazyCall(fn, *args)
+
+    def map(self, fn, *iterables):
+        return map(fn, *iterables)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+def _get_executor(max_workers: int):
+    return ThreadPoolExecutor(max_workers=max_workers) if max_workers > 1 else _InlineExecutor()
+
+
 PeriodTyping = Literal['Day', 'Week', 'Month', 'Year', 'AllTime']
 ImageSortTyping = Literal['Newest', 'Oldest', 'Most Reactions', 'Most Buzz', 'Most Comments', 'Most Collected']
 TagSortTyping = Literal['Most Models', 'Most Images', 'Most Posts', 'Most Articles', 'Most Hidden']
@@ -57,7 +99,25 @@ class Level(IntFlag):
     ALL = PG | PG13 | R | X | XXX
 
 
+def _has_marks(data, mark) -> bool:
+    stack = [data]
+    while stack:
+        node = stack.pop()
+        if node is mark or node is m_none:
+            return True
+        elif isinstance(node, dict):
+            stack.extend(node.values())
+        elif isinstance(node, (list, tuple)):
+            stack.extend(node)
+
+    return False
+
+
 def _replace_mark(data, mark, v_mark):
+    # subtrees without any mark are shared with the input instead of being rebuilt
+    if not _has_marks(data, mark):
+        return data
+
     if isinstance(data, dict):
         retval = {}
         for key, value in data.items():
@@ -76,29 +136,118 @@ def _replace_mark(data, mark, v_mark):
         return data if data is not mark else v_mark
 
 
-def _replace_page(data, page):
-    return _replace_mark(data, m_page, page)
+def _make_mark_setter(data, mark):
+    # templates in this module keep the mark at the top level, so only those keys are replaced per request,
+    # anything else falls back to the full walk
+    base = _replace_mark(data, mark, mark)
+    if isinstance(base, dict):
+        keys = [key for key, value in base.items() if value is mark]
+        if keys and not _has_marks([value for value in base.values() if value is not mark], mark):
+            def _set(value):
+                retval = dict(base)
+                for key in keys:
+                    retval[key] = value
+                return retval
 
+            return _set
 
-def _replace_cursor(data, cursor):
-    return _replace_mark(data, m_cursor, cursor)
+    return lambda value: _replace_mark(data, mark, value)
+
+
+_PLAIN_JSON_TYPES = (str, int, float, bool, type(None))
+
+
+def _make_input_renderer(data, mark):
+    # serialize the request template only once, with a placeholder string where the mark is,
+    # then each page just substitutes the placeholder with the serialized value
+    placeholder = f'__civitai_{mark.mark}__'
+    template = json_dumps(req_data_format(_replace_mark(data, mark, placeholder)))
+    quoted_placeholder = json_dumps(placeholder)
+
+    def _render(value) -> Optional[str]:
+        if isinstance(value, _PLAIN_JSON_TYPES):
+            return template.replace(quoted_placeholder, json_dumps(value))
+        else:  # values like undefined need superjson meta, they have to be formatted as a whole
+            return None
+
+    return _render
+
+
+_NORM_PATTERN = re.compile(r'[\W_]+')
+_NORM_TABLE_SPACE = {c: ' ' for c in range(128) if not chr(c).isalnum()}
+_NORM_TABLE_NO_SPACE = {c: None for c in range(128) if not chr(c).isalnum()}
 
 
 def _norm(x, keep_space: bool = True):
-    return re.sub(r'[\W_]+', ' ' if keep_space else '', x.lower()).strip()
+    x = x.lower()
+    if x.isascii():  # fast path, same result as the regex for ascii text
+        if keep_space:
+            return ' '.join(x.translate(_NORM_TABLE_SPACE).split())
+        else:
+            return x.translate(_NORM_TABLE_NO_SPACE)
+    else:
+        return _NORM_PATTERN.sub(' ' if keep_space else '', x).strip()
 
 
 def _model_tag_same(x, y):
     return _norm(x, keep_space=True) == _norm(y, keep_space=True)
 
 
-def _vae_model_same(x, y):
-    return _norm(x, keep_space=False) == _norm(y, keep_space=False)
+def _is_utf8(encoding: Optional[str]) -> bool:
+    try:
+        return codecs.lookup(encoding).name == 'utf-8'
+    except LookupError:
+        return False
+
+
+def _load_resp_json(resp: requests.Response):
+    # parse the raw body directly, decoding it to str first is only needed for non-utf8 charsets
+    if resp.encoding is None or _is_utf8(resp.encoding):
+        return json_loads(resp.content)
+    else:
+        return json_loads(resp.text)
+
+
+@contextmanager
+def _file_body(local_file: str):
+    # a buffer body is passed to the socket in one sendall, file objects are read 16KiB at a time
+    with open(local_file, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:  # empty files cannot be mapped
+            yield b''
+        else:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as body:
+                yield body
+
+
+_MARKDOWN_RENDER = None
+
+
+def _render_markdown(text: str) -> str:
+    # resolved on first use, cmarkgfm (C) is preferred when installed, markdown2 otherwise
+    global _MARKDOWN_RENDER
+    if _MARKDOWN_RENDER is None:
+        try:
+            import cmarkgfm
+            from cmarkgfm.cmark import Options
+        except (ImportError, ModuleNotFoundError):
+            import markdown2
+            _MARKDOWN_RENDER = markdown2.markdown
+        else:
+            # keep raw html in descriptions, just like markdown2 does
+            def _MARKDOWN_RENDER(t):
+                return cmarkgfm.github_flavored_markdown_to_html(t, options=Options.CMARK_OPT_UNSAFE)
+
+    return _MARKDOWN_RENDER(textwrap.dedent(text))
 
 
 ReactionTyping = Literal['Like', 'Dislike', 'Heart', 'Laugh', 'Cry']
 CommercialUseTyping = Literal['Image', 'RentCivit', 'Rent', 'Sell']
 DEFAULT_COMMERCIAL_USE: List[CommercialUseTyping] = ['RentCivit', 'Rent']
+VAE_CACHE_TTL = 300  # seconds
+ETAG_CACHE_SIZE = 256
+POST_TAG_CACHE_SIZE = 2048
+_JSON_HEADERS = {'Content-Type': 'application/json'}
+_UPLOAD_REFERER_HEADERS = {'Referer': 'https://civitai.com/models/0/wizard?step=3'}
 
 ModelTypeTyping = Literal[
     'Checkpoint', 'Embedding', 'Hypernetwork', 'AestheticGradient', 'LORA', 'LoCon', 'DoRA',
@@ -108,112 +257,177 @@ CheckpointTypeTyping = Literal['Trained', 'Merge']
 
 
 class CivitAIClient:
-    def __init__(self, session: requests.Session, raw_user_info: Optional[Mapping[str, Any]] = None):
+    def __init__(self, session: requests.Session, raw_user_info: Optional[Mapping[str, Any]] = None,
+                 prefetch: bool = False):
 
         self._session = session
+        # the next page is requested from a pool thread while the current one is consumed.
+        # this shares the session with another thread, and early-exiting consumers pay for one extra request
+        self._prefetch = prefetch
+        mount_civitai_adapter(self._session)
+        # uploads go to storage hosts outside civitai.com, which the stock adapter would pool only 10 deep,
+        # adapters configured by the caller (ssl, proxies, retries) are left untouched
+        if type(self._session.get_adapter('https://')) is HTTPAdapter:
+            self._session.mount('https://', get_pooled_adapter(pool_size=32, max_retries=5, backoff_factor=0.5))
         self._whoami_value = get_whoami_by_raw_user_info(raw_user_info)
+        # read by almost every payload builder, the login state never changes for a client
+        self._authed: bool = bool(self._whoami_value)
+        self._vae_index: Optional[Tuple[float, Mapping[str, Any]]] = None
+        self._tag_query_cache: Dict[str, Optional[dict]] = {}
+        # (url, input) -> (etag, raw body), for conditional GETs
+        self._etag_cache = LRUCache(maxsize=ETAG_CACHE_SIZE)
+        # normalized post tag -> (tag id, tag name), shared by the upload worker threads
+        self._post_tag_cache = LRUCache(maxsize=POST_TAG_CACHE_SIZE)
 
     @classmethod
-    def load(cls, anything: Optional[CookiesTyping] = None) -> 'CivitAIClient':
+    def load(cls, anything: Optional[CookiesTyping] = None, prefetch: bool = False) -> 'CivitAIClient':
         session, raw_user_info = load_civitai_session(anything)
-        return cls(session=session, raw_user_info=raw_user_info)
+        return cls(session=session, raw_user_info=raw_user_info, prefetch=prefetch)
 
     @classmethod
-    def no_login(cls) -> 'CivitAIClient':
-        return cls.load(None)
+    def no_login(cls, prefetch: bool = False) -> 'CivitAIClient':
+        return cls.load(None, prefetch=prefetch)
 
     @property
     def whoami(self) -> Optional[WhoAmI]:
         return self._whoami_value
 
-    @property
-    def _authed(self) -> bool:
-        return bool(self.whoami)
-
     @property
     def _username(self) -> str:
-        if self.whoami:
-            return self.whoami.username
+        if self._authed:
+            return self._whoami_value.username
         else:
             raise SessionError('You need to login first.')
 
     @property
     def _userid(self) -> int:
-        if self.whoami:
-            return self.whoami.id
+        if self._authed:
+            return self._whoami_value.id
         else:
             raise SessionError('You need to login first.')
 
     @classmethod
     def _resp_postprocess(cls, resp, parse: bool = True):
         try:
-            json_ = resp.json()
+            json_ = _load_resp_json(resp)
         except json.JSONDecodeError:
             resp.raise_for_status()
         else:
-            if 'error' in json_:
-                raise APIError(resp, resp_data_parse(json_['error']))
-            if 'error' in json_['result']:
-                raise APIError(resp, resp_data_parse(json_['result']['data']))
+            return cls._json_postprocess(resp, json_, parse=parse)
 
-            if parse:
-                return resp_data_parse(json_['result']['data'])
-            else:
-                return json_
+    @classmethod
+    def _json_postprocess(cls, resp, json_, parse: bool = True):
+        if 'error' in json_:
+            raise APIError(resp, resp_data_parse(json_['error']))
+        if 'error' in json_['result']:
+            raise APIError(resp, resp_data_parse(json_['result']['data']))
+
+        if parse:
+            return resp_data_parse(json_['result']['data'])
+        else:
+            return json_
 
-    def _get(self, url, data=undefined, parse: bool = True):
+    def _get(self, url, data=undefined, parse: bool = True, use_etag: bool = False):
         data = req_data_format(data)
         logging.debug(f'GET {url!r}, data: {data!r} ...')
-        return self._resp_postprocess(self._session.get(
+        return self._get_by_input(url, json_dumps(data), parse=parse, use_etag=use_etag)
+
+    def _get_by_input(self, url, input_: str, parse: bool = True, use_etag: bool = False):
+        # conditional GETs only for single objects fetched again and again, not for iterated pages,
+        # which would fill the cache with bodies that are never requested twice
+        if not use_etag:
+            return self._resp_postprocess(self._session.get(
+                urljoin(CIVITAI_ROOT, url),
+                params={'input': input_},
+            ), parse=parse)
+
+        key = (url, input_)
+        cached = self._etag_cache.get(key)
+        resp = self._session.get(
             urljoin(CIVITAI_ROOT, url),
-            params={'input': json.dumps(data)},
-        ), parse=parse)
+            params={'input': input_},
+            headers={'If-None-Match': cached[0]} if cached else None,
+        )
+        if cached and resp.status_code == 304:
+            return self._json_postprocess(resp, json_loads(cached[1]), parse=parse)
+
+        etag = resp.headers.get('ETag')
+        if etag and resp.status_code == 200 and _is_utf8(resp.encoding or 'utf-8'):
+            self._etag_cache.set(key, (etag, resp.content))
+        return self._resp_postprocess(resp, parse=parse)
 
     def _post(self, url, data=undefined, parse: bool = True):
         data = req_data_format(data)
         logging.debug(f'GET {url!r}, data: {data!r} ...')
         return self._resp_postprocess(self._session.post(
             urljoin(CIVITAI_ROOT, url),
-            json=data,
+            data=json_dumpb(data),
+            headers=_JSON_HEADERS,
         ), parse=parse)
 
     @classmethod
-    def _iter_via_cursor_fn(cls, fn):
-        cursor = undefined
+    def _iter_via_cursor_fn(cls, fn, prefetch: bool = False):
+        items, cursor = fn(undefined)
         while True:
-            items, cursor = fn(cursor)
-            yield from items
+            future = _schedule(prefetch, fn, cursor) if cursor is not None else None
+            try:
+                yield from items
+            except GeneratorExit:
+                if future is not None:
+                    future.cancel()
+                raise
 
-            if cursor is None:
+            if future is None:
                 break
+            items, cursor = future.result()
 
     def _iter_via_cursor(self, url, data, items_key: str = 'items'):
+        render_input = _make_input_renderer(data, m_cursor)
+        set_cursor = _make_mark_setter(data, m_cursor)
+
         def _fn(cursor):
-            resp_data = self._get(url, _replace_cursor(data, cursor))
+            input_ = render_input(cursor)
+            if input_ is not None:
+                logging.debug(f'GET {url!r}, input: {input_!r} ...')
+                resp_data = self._get_by_input(url, input_)
+            else:
+                resp_data = self._get(url, set_cursor(cursor))
             return resp_data[items_key], resp_data['nextCursor']
 
-        yield from self._iter_via_cursor_fn(_fn)
+        yield from self._iter_via_cursor_fn(_fn, prefetch=self._prefetch)
 
     @classmethod
-    def _iter_via_page_fn(cls, fn):
+    def _iter_via_page_fn(cls, fn, prefetch: bool = False):
+        def _fetch(page_):
+            return list(fn(page_))
+
         page = 1
-        while True:
-            items = fn(page)
-            is_empty = True
-            for item in items:
-                yield item
-                is_empty = False
+        items = _fetch(page)
+        while items:
+            future = _schedule(prefetch, _fetch, page + 1)
+            try:
+                yield from items
+            except GeneratorExit:
+                future.cancel()
+                raise
 
-            if is_empty:
-                break
+            items = future.result()
             page += 1
 
     def _iter_via_page(self, url, data):
+        render_input = _make_input_renderer(data, m_page)
+        set_page = _make_mark_setter(data, m_page)
+
         def _fn(page):
-            resp_data = self._get(url, _replace_page(data, page))
+            input_ = render_input(page)
+            if input_ is not None:
+                logging.debug(f'GET {url!r}, input: {input_!r} ...')
+                resp_data = self._get_by_input(url, input_)
+            else:
+                resp_data = self._get(url, set_page(page))
             return resp_data['items']
 
-        yield from self._iter_via_page_fn(_fn)
+        yield from self._iter_via_page_fn(_fn, prefetch=self._prefetch)
 
     def get_buzz_count(self):
         return self._get('/api/trpc/buzz.getUserAccount')
@@ -395,7 +609,8 @@ class CivitAIClient:
             {
                 "username": username,
                 "authed": self._authed
-            }
+            },
+            use_etag=True,
         )
 
     def get_creator_by_id(self, userid: int):
@@ -404,7 +619,8 @@ class CivitAIClient:
             {
                 'id': userid,
                 'authed': self._authed,
-            }
+            },
+            use_etag=True,
         )
 
     def get_myself(self):
@@ -416,7 +632,8 @@ class CivitAIClient:
             {
                 "id": article_id,
                 "authed": self._authed,
-            }
+            },
+            use_etag=True,
         )
 
     def get_article_comments(self, article_id: int):
@@ -463,7 +680,8 @@ class CivitAIClient:
             {
                 "id": model_id,
                 "authed": self._authed,
-            }
+            },
+            use_etag=True,
         )
 
     def iter_model_images(self, model_id):
@@ -620,10 +838,28 @@ class CivitAIClient:
             {
                 "type": "VAE",
                 "authed": True,
-            }
+            },
+            use_etag=True,
         )
 
+    def _query_vae_id(self, vae_name: str) -> Optional[int]:
+        if self._vae_index is None or self._vae_index[0] + VAE_CACHE_TTL <= time.monotonic():
+            self._vae_index = (time.monotonic(), {
+                _norm(vae_item['modelName'], keep_space=False): vae_item
+                for vae_item in self.query_vae_models()
+            })
+
+        vae_item = self._vae_index[1].get(_norm(vae_name, keep_space=False))
+        return vae_item['id'] if vae_item else None
+
     def _query_model_tag(self, tag: str) -> Optional[dict]:
+        # tags with the same normalized name always resolve to the same civitai tag, not found ones included
+        key = _norm(tag)
+        if key not in self._tag_query_cache:
+            self._tag_query_cache[key] = self._search_model_tag(tag)
+        return self._tag_query_cache[key]
+
+    def _search_model_tag(self, tag: str) -> Optional[dict]:
         logging.info(f'Querying tag {tag!r} from civitai ...')
         for item in self.iter_model_tags(tag):
             if _model_tag_same(item['name'], tag):
@@ -642,23 +878,25 @@ class CivitAIClient:
         for tag in [*tags, category]:
             tag_item = self._query_model_tag(tag)
             if tag_item:
-                if tag_item['id'] not in exist_tag_ids and tag_item['name'].lower() not in exist_tags:
+                tag_key = _norm(tag_item['name'])
+                if tag_item['id'] not in exist_tag_ids and tag_key not in exist_tags:
                     if tag_item['isCategory']:
                         tags_data.append({'id': tag_item['id'], 'name': tag_item['name'], 'models': undefined})
                     else:
                         tags_data.append({'id': tag_item['id'], 'name': tag_item['name'], 'isCategory': False})
                     exist_tag_ids.add(tag_item['id'])
-                    exist_tags.add(tag_item['name'].lower())
+                    exist_tags.add(tag_key)
 
             else:
-                if tag.lower() not in exist_tags:
+                tag_key = _norm(tag)
+                if tag_key not in exist_tags:
                     tags_data.append({'id': undefined, 'name': tag})
-                    exist_tags.add(tag.lower())
+                    exist_tags.add(tag_key)
 
         commercial_use = DEFAULT_COMMERCIAL_USE if commercial_use is None else commercial_use
         post_json = {
             "name": name,
-            "description": markdown2.markdown(textwrap.dedent(description_md)),
+            "description": _render_markdown(description_md),
             "type": type_,
             "checkpointType": None if type_.upper() != 'Checkpoint' else checkpoint_type,
 
@@ -686,10 +924,14 @@ class CivitAIClient:
         else:
             logging.info(f'Creating model {name!r}, tags: {[item["name"] for item in tags_data]!r} ...')
 
-        return self._post(
+        retval = self._post(
             '/api/trpc/model.upsert',
             post_json
         )
+        for item in tags_data:  # these tags are created on civitai now
+            if item['id'] is undefined:
+                self._tag_query_cache.pop(_norm(item['name']), None)
+        return retval
 
     def upsert_version(
             self, model_id: int, version_name: str, description_md: str, trigger_words: List[str],
@@ -698,11 +940,7 @@ class CivitAIClient:
             recommended_resources: List[int] = None, require_auth_when_download: bool = False,
             exist_version_id: Optional[int] = None
     ):
-        vae_id = None
-        if vae_name:
-            for vae_item in self.query_vae_models():
-                if _vae_model_same(vae_item['modelName'], vae_name):
-                    vae_id = vae_item['id']
+        vae_id = self._query_vae_id(vae_name) if vae_name else None
 
         logging.info(f'Creating version {version_name!r} for model {model_id}, with base model {base_model!r} ...')
         post_json = {
@@ -710,7 +948,7 @@ class CivitAIClient:
             "name": version_name,
             "baseModel": base_model,
             "baseModelType": undefined,
-            "description": markdown2.markdown(textwrap.dedent(description_md)),
+            "description": _render_markdown(description_md),
             "steps": steps,
             "epochs": epochs,
             "clipSkip": clip_skip,
@@ -744,6 +982,7 @@ class CivitAIClient:
 
     def _upload_file(self, local_file: str, type_: str = 'model', filename: str = None):
         filename = filename or os.path.basename(local_file)
+        file_size = os.path.getsize(local_file)
         logging.info(f'Creating uploading request for {filename!r} ...')
 
         resp = self._session.post(
@@ -751,20 +990,20 @@ class CivitAIClient:
             json={
                 "filename": filename,
                 "type": type_,
-                "size": os.path.getsize(local_file),
+                "size": file_size,
             },
-            headers={'Referer': f'https://civitai.com/models/0/wizard?step=3'}
+            headers=_UPLOAD_REFERER_HEADERS
         )
         resp.raise_for_status()
-        upload_data = resp.json()
+        upload_data = _load_resp_json(resp)
         assert len(upload_data['urls']) == 1, \
             'Multipart uploading not supported yet, please kick narugo1992\'s ass on issue block.'
 
         logging.info(f'Uploading file {local_file!r} as {filename!r} ...')
-        with open(local_file, 'rb') as f:
+        with _file_body(local_file) as body:
             resp = self._session.put(
-                upload_data['urls'][0]['url'], data=f,
-                headers={'Referer': f'https://civitai.com/models/0/wizard?step=3'},
+                upload_data['urls'][0]['url'], data=body,
+                headers=_UPLOAD_REFERER_HEADERS,
             )
             resp.raise_for_status()
             etag = resp.headers['ETag']
@@ -779,17 +1018,17 @@ class CivitAIClient:
                 "uploadId": upload_data['uploadId'],
                 "parts": [{"ETag": etag, "PartNumber": 1}],
             },
-            headers={'Referer': f'https://civitai.com/models/0/wizard?step=3'},
+            headers=_UPLOAD_REFERER_HEADERS,
         )
         resp.raise_for_status()
 
         return {
-            "url": str(URLObject(upload_data['urls'][0]['url']).without_query()),
+            "url": urlsplit(upload_data['urls'][0]['url'])._replace(query='').geturl(),
             "bucket": upload_data['bucket'],
             "key": upload_data['key'],
             "name": filename,
             "uuid": str(uuid.uuid4()),
-            "sizeKB": os.path.getsize(local_file) / 1024.0,
+            "sizeKB": file_size / 1024.0,
         }
 
     def upload_models(self, model_version_id: int, model_files: List[Union[str, Tuple[str, str]]]):
@@ -820,54 +1059,50 @@ class CivitAIClient:
                 },
             )
 
+    # (parameter key, meta key, cast), applied in this order after the raw copy
+    _META_KEYS = (
+        ('CFG scale', 'cfgScale', int),
+        ('Steps', 'steps', int),
+        ('Sampler', 'sampler', None),
+        ('Seed', 'seed', int),
+        ('Clip skip', 'clipSkip', int),
+    )
+    # sizes are sent as 'WxH' strings, except these, which civitai has always received as [w, h] lists
+    _META_RAW_SIZE_KEYS = frozenset({'Hires resize'})
+
     @classmethod
-    def _get_meta_from_image_file(cls, image_file: str):
-        sd_meta = get_sdmeta_from_image(image_file)
+    def _get_meta_from_image(cls, image: Union[str, 'Image.Image']):
+        from imgutils.sd import get_sdmeta_from_image
+
+        sd_meta = get_sdmeta_from_image(image)
         if not sd_meta:
             return {}
 
         else:
+            params = sd_meta.parameters
             meta = {
                 'prompt': sd_meta.prompt,
                 'negativePrompt': sd_meta.neg_prompt,
             }
-            for key, value in sd_meta.parameters.items():
-                if isinstance(value, tuple):
+            for key, value in params.items():
+                if isinstance(value, tuple) and key not in cls._META_RAW_SIZE_KEYS:
                     meta[key] = f'{value[0]}x{value[1]}'
                 else:
                     meta[key] = value
-            if sd_meta.parameters.get('CFG scale'):
-                meta['cfgScale'] = int(sd_meta.parameters['CFG scale'])
-            if sd_meta.parameters.get('Steps'):
-                meta['steps'] = int(sd_meta.parameters['Steps'])
-            if sd_meta.parameters.get('Sampler'):
-                meta['sampler'] = sd_meta.parameters['Sampler']
-            if sd_meta.parameters.get('Seed'):
-                meta['seed'] = int(sd_meta.parameters['Seed'])
-            if sd_meta.parameters.get('Size'):
-                width, height = sd_meta.parameters['Size']
-                meta['Size'] = f'{width}x{height}'
-            if sd_meta.parameters.get('Clip skip'):
-                meta['clipSkip'] = int(sd_meta.parameters['Clip skip'])
-            if sd_meta.parameters.get('Model'):
-                meta['Model'] = sd_meta.parameters['Model']
-            if sd_meta.parameters.get('Model hash'):
-                model_hash = sd_meta.parameters['Model hash']
+
+            for key, meta_key, cast in cls._META_KEYS:
+                value = params.get(key)
+                if value:
+                    meta[meta_key] = cast(value) if cast else value
+
+            model, model_hash = params.get('Model'), params.get('Model hash')
+            if model_hash:
                 meta['hashes'] = {'model': model_hash}
-                meta["Model hash"] = model_hash
-            if sd_meta.parameters.get('Hires resize'):
-                meta["Hires resize"] = sd_meta.parameters['Hires resize']
-            if sd_meta.parameters.get('Hires steps'):
-                meta["Hires steps"] = sd_meta.parameters['Hires steps']
-            if sd_meta.parameters.get('Hires upscaler'):
-                meta["Hires upscaler"] = sd_meta.parameters['Hires upscaler']
-            if sd_meta.parameters.get('Denoising strength'):
-                meta["Denoising strength"] = sd_meta.parameters['Denoising strength']
-            if sd_meta.parameters.get('Model') and sd_meta.parameters.get('Model hash'):
+            if model and model_hash:
                 meta["resources"] = [
                     {
-                        "hash": sd_meta.parameters['Model hash'],
-                        "name": sd_meta.parameters['Model'],
+                        "hash": model_hash,
+                        "name": model,
                         "type": "model"
                     }
                 ]
@@ -891,17 +1126,37 @@ class CivitAIClient:
         return width, height
 
     @classmethod
-    def _get_image_info(cls, local_file: str) -> Tuple[int, int, str]:
-        img = load_image(local_file, force_background='white', mode='RGB')
-        new_width, new_height = cls._get_clamped_size(img.width, img.height, 32)
-        return img.width, img.height, blurhash.encode(np.array(img.resize((new_width, new_height))))
+    def _get_image_info(cls, image: Union[str, 'Image.Image'], draft: bool = False) -> Tuple[int, int, str]:
+        import numpy as np
+        from PIL import Image
+        from imgutils.data import load_image
+        from .bhash import blurhash_encode
+
+        if not isinstance(image, Image.Image):
+            with Image.open(image) as image:
+                return cls._get_image_info(image, draft=True)
+
+        width, height = image.size
+        new_width, new_height = cls._get_clamped_size(width, height, 32)
+        # blurhash only needs a tiny thumbnail, so shrink before any full-size conversion
+        # jpeg can be decoded at a reduced scale directly, but that shrinks the given image in place,
+        # so it is only done when the image is not used afterward
+        if draft:
+            image.draft('RGB', (new_width, new_height))
+        # paletted images must not be resized as-is
+        if image.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+            image = image.convert('RGBA')
+        image = image.resize((new_width, new_height), Image.BILINEAR, reducing_gap=2.0)
+
+        img = load_image(image, force_background='white', mode='RGB')
+        return width, height, blurhash_encode(np.asarray(img))
 
     def query_post_tags(self, tag: str):
         resp = self._session.get(
             'https://civitai.com/api/trpc/post.getTags',
             params={
                 'batch': '1',
-                'input': json.dumps({
+                'input': json_dumps({
                     "0": {
                         "json": {
                             "query": tag,
@@ -912,7 +1167,43 @@ class CivitAIClient:
             }
         )
         resp.raise_for_status()
-        return resp.json()[0]['result']['data']['json']
+        return _load_resp_json(resp)[0]['result']['data']['json']
+
+    def _resolve_post_tag(self, tag: str) -> Tuple[Optional[int], str]:
+        # only existing tags are cached, missing ones get created by post.addTag and must be looked up again
+        key = _norm(tag, keep_space=True)
+        resolved = self._post_tag_cache.get(key)
+        if resolved is not None:
+            return resolved
+
+        for tag_item in self.query_post_tags(tag):
+            if _model_tag_same(tag_item['name'], tag):
+                resolved = tag_item['id'], tag_item['name']
+                self._post_tag_cache.set(key, resolved)
+                return resolved
+        return None, tag
+
+    def _add_post_tag(self, post_id: int, tag_id: Optional[int], tag_name: str) -> Optional[APIError]:
+        if tag_id is not None:
+            logging.info(f'Adding tag {tag_name!r}({tag_id}) for post {post_id!r} ...')
+        else:
+            logging.info(f'Creating and adding new tag {tag_name!r} for post {post_id!r} ...')
+        try:
+            _ = self._post(
+                '/api/trpc/post.addTag',
+                {
+                    "id": post_id,
+                    "tagId": tag_id if tag_id is not None else undefined,
+                    "name": tag_name,
+                    "authed": True,
+                },
+            )
+        except APIError as err:
+            # 2024-1-27, this api will sometimes down. I don't know why
+            # <APIError status: 404, error: {'message': 'No Post found', 'code': -32004, 'data': {'code': 'NOT_FOUND', 'httpStatus': 404, 'path': 'post.addTag'}}>
+            return err
+        else:
+            return None
 
     def upload_image(self, local_file: str) -> CivitaiImage:
         filename = os.path.basename(local_file)
@@ -924,21 +1215,44 @@ class CivitAIClient:
             },
         )
         resp.raise_for_status()
-        upload_id = resp.json()['id']
-        upload_url = resp.json()['uploadURL']
+        upload_data = _load_resp_json(resp)
+        upload_id = upload_data['id']
+        upload_url = upload_data['uploadURL']
 
         logging.info(f'Uploading local image {local_file!r} as image {filename!r} ...')
-        with open(local_file, 'rb') as f:
-            resp = self._session.put(upload_url, data=f)
+        with _file_body(local_file) as body:
+            resp = self._session.put(upload_url, data=body)
             resp.raise_for_status()
 
         return CivitaiImage(id=upload_id, filename=filename)
 
+    def _prepare_post_image(self, local_file: str):
+        from PIL import Image
+
+        upload_image = self.upload_image(local_file)
+        # one open for both, the meta must be read first, the blurhash pass drafts the image down in place
+        with Image.open(local_file) as image:
+            meta = self._get_meta_from_image(image)
+            width, height, bhash = self._get_image_info(image, draft=True)
+        return upload_image, width, height, bhash, meta
+
     def upload_images_for_model_version(
             self, model_version_id: int,
             image_files: Union[List[str], List[Tuple[str, str]]],
-            tags: List[str], nsfw: bool = False,
+            tags: List[str], nsfw: bool = False, max_workers: int = 1,
     ):
+        # max_workers > 1 uploads and analyses the images concurrently, and those threads share this client's session
+        upload_items = []
+        for upload_item in image_files:
+            if isinstance(upload_item, tuple):
+                local_file, filename = upload_item
+            elif isinstance(upload_item, str):
+                local_file = upload_item
+                filename = os.path.basename(local_file)
+            else:
+                raise TypeError(f'Unknown type of upload image - {upload_item!r}.')
+            upload_items.append((local_file, filename))
+
         logging.info(f'Creating post for model version {model_version_id} ...')
         resp = self._post(
             '/api/trpc/post.create',
@@ -949,66 +1263,50 @@ class CivitAIClient:
         )
         post_id = resp['id']
 
-        for index, upload_item in enumerate(tqdm(image_files,
-                                                 desc=f'Uploading {plural_word(len(image_files), "image")}')):
-            if isinstance(upload_item, tuple):
-                local_file, filename = upload_item
-            elif isinstance(upload_item, str):
-                local_file = upload_item
-                filename = os.path.basename(local_file)
-            else:
-                raise TypeError(f'Unknown type of upload image - {upload_item!r}.')
-
-            upload_image = self.upload_image(local_file)
-
-            logging.info(f'Completing the uploading of {filename!r} ...')
-            width, height, bhash = self._get_image_info(local_file)
-            self._post(
-                '/api/trpc/post.addImage',
-                {
-                    "type": "image",
-                    "index": index,
-                    "uuid": str(uuid.uuid4()),
-                    "name": filename,
-                    "meta": self._get_meta_from_image_file(local_file),
-                    "url": upload_image.id,
-                    "mimeType": "image/png",
-                    "hash": bhash,
-                    "width": width,
-                    "height": height,
-                    "status": "uploading",
-                    "message": undefined,
-                    "postId": post_id,
-                    "modelVersionId": model_version_id,
-                    "authed": True
-                }
-            )
-
-        for tag in tags:
-            for tag_item in self.query_post_tags(tag):
-                if _model_tag_same(tag_item['name'], tag):
-                    tag_id, tag_name = tag_item['id'], tag_item['name']
-                    break
-            else:
-                tag_id, tag_name = None, tag
-
-            if tag_id is not None:
-                logging.info(f'Adding tag {tag_name!r}({tag_id}) for post {post_id!r} ...')
-            else:
-                logging.info(f'Creating and adding new tag {tag_name!r} for post {post_id!r} ...')
+        # uploading and image analysis are independent per file, only post.addImage has to keep the order
+        with _get_executor(max_workers) as pool:
+            futures = [pool.submit(self._prepare_post_image, local_file) for local_file, _ in upload_items]
             try:
-                _ = self._post(
-                    '/api/trpc/post.addTag',
-                    {
-                        "id": post_id,
-                        "tagId": tag_id if tag_id is not None else undefined,
-                        "name": tag_name,
-                        "authed": True,
-                    },
-                )
-            except APIError as err:
-                # 2024-1-27, this api will sometimes down. I don't know why
-                # <APIError status: 404, error: {'message': 'No Post found', 'code': -32004, 'data': {'code': 'NOT_FOUND', 'httpStatus': 404, 'path': 'post.addTag'}}>
+                for index, ((_, filename), future) in enumerate(tqdm(
+                        list(zip(upload_items, futures)),
+                        desc=f'Uploading {plural_word(len(upload_items), "image")}')):
+                    upload_image, width, height, bhash, meta = future.result()
+
+                    logging.info(f'Completing the uploading of {filename!r} ...')
+                    self._post(
+                        '/api/trpc/post.addImage',
+                        {
+                            "type": "image",
+                            "index": index,
+                            "uuid": str(uuid.uuid4()),
+                            "name": filename,
+                            "meta": meta,
+                            "url": upload_image.id,
+                            "mimeType": "image/png",
+                            "hash": bhash,
+                            "width": width,
+                            "height": height,
+                            "status": "uploading",
+                            "message": undefined,
+                            "postId": post_id,
+                            "modelVersionId": model_version_id,
+                            "authed": True
+                        }
+                    )
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+
+        # tags are independent of each other, so lookups and additions are overlapped
+        unique_tags = {}
+        for tag in tags:
+            unique_tags.setdefault(_norm(tag, keep_space=True), tag)
+        with _get_executor(max_workers) as pool:
+            resolved_tags = list(pool.map(self._resolve_post_tag, unique_tags.values()))
+            errors = list(pool.map(lambda x: self._add_post_tag(post_id, *x), resolved_tags))
+        for err in errors:
+            if err is not None:
                 warnings.warn(f'Error occurred when adding tag: {err!r}.')
 
         logging.info(f'Marking for nsfw ({nsfw!r}) ...')
@@ -1,10 +1,14 @@
-import copy
 import datetime
 from typing import Dict, Callable, Any, Tuple, Type, Optional
 
-import dateparser
+from civitai.utils import parse_time, parse_time_text
 
-from civitai.utils import parse_time
+try:
+    from zoneinfo import ZoneInfo
+except (ImportError, ModuleNotFoundError):
+    from backports.zoneinfo import ZoneInfo
+
+_UTC = ZoneInfo('UTC')
 
 
 class _JsUndefined:
@@ -14,51 +18,48 @@ class _JsUndefined:
 undefined = _JsUndefined()
 
 _SUPERJSON_PARSERS: Dict[str, Callable[[Any], Any]] = {
-    'Date': dateparser.parse,
+    'Date': parse_time_text,
     'undefined': lambda x: None,
 }
 
 
 def resp_data_parse(native):
     raw, meta = native['json'], native.get('meta') or {}
-    retval = copy.deepcopy(raw)
-
-    if meta.get('values'):
-        if isinstance(meta['values'], dict):
-            for key_str, value in meta['values'].items():
-                key_segments = key_str.split('.')
-                node, key = retval, None
-                for segment in key_segments:
-                    if key is None:
-                        key = segment
-                    else:
-                        if isinstance(node, list):
-                            key = int(key)
-                        node, key = node[key], segment
-
-                assert key is not None, f'Empty key string {key_str!r} detected.'
-                node[key] = _SUPERJSON_PARSERS[value[0]](node[key])
-
-        elif isinstance(meta['values'], list):
-            assert len(meta['values']) == 1, \
-                f'Values of meta should have only one element, but {meta["values"]!r} found.'
-            retval = _SUPERJSON_PARSERS[meta['values'][0]](retval)
+    if not meta.get('values'):
+        return raw
+
+    # converted in place, native is always a freshly decoded response owned by the caller
+    retval = raw
+    if isinstance(meta['values'], dict):
+        for key_str, value in meta['values'].items():
+            key_segments = key_str.split('.')
+            node, key = retval, None
+            for segment in key_segments:
+                if key is None:
+                    key = segment
+                else:
+                    if isinstance(node, list):
+                        key = int(key)
+                    node, key = node[key], segment
+
+            assert key is not None, f'Empty key string {key_str!r} detected.'
+            node[key] = _SUPERJSON_PARSERS[value[0]](node[key])
+
+    elif isinstance(meta['values'], list):
+        assert len(meta['values']) == 1, \
+            f'Values of meta should have only one element, but {meta["values"]!r} found.'
+        retval = _SUPERJSON_PARSERS[meta['values'][0]](retval)
 
-        else:
-            raise TypeError(f'Unknown meta values type - {meta["values"]!r}.')
+    else:
+        raise TypeError(f'Unknown meta values type - {meta["values"]!r}.')
 
     return retval
 
 
 def _format_time(publish_at: Optional[str] = None) -> Optional[str]:
-    try:
-        from zoneinfo import ZoneInfo
-    except (ImportError, ModuleNotFoundError):
-        from backports.zoneinfo import ZoneInfo
-
     if publish_at is not None:
         local_time = parse_time(publish_at)
-        publish_at = local_time.astimezone(ZoneInfo('UTC')).isoformat()
+        publish_at = local_time.astimezone(_UTC).isoformat()
 
     return publish_at
 
@@ -67,34 +68,60 @@ _SUPERJSON_FORMATTERS: Dict[Type, Tuple[str, Callable[[Any], Any]]] = {
     _JsUndefined: ('undefined', lambda x: None),
     datetime.datetime: ('Date', _format_time),
 }
+assert set(_SUPERJSON_FORMATTERS) == {_JsUndefined, datetime.datetime}, \
+    'Special types are matched by identity in _has_special and req_data_format, update them as well.'
+
+
+def _has_special(native) -> bool:
+    stack = [native]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, list):
+            stack.extend(node)
+        elif isinstance(node, dict):
+            stack.extend(node.values())
+        elif type(node) is _JsUndefined or type(node) is datetime.datetime:
+            return True
+
+    return False
 
 
 def req_data_format(native):
+    # most payloads are plain json, which can be sent as-is without rebuilding
+    if not _has_special(native):
+        return {'json': native}
+
     meta = {}
+    path = []  # shared by the whole walk, the key string is only built for special values
 
-    def _recursion(node, keys):
+    def _recursion(node):
         if isinstance(node, list):
-            return [
-                _recursion(item, [*keys, i])
-                for i, item in enumerate(node)
-            ]
+            retval_ = []
+            for i, item in enumerate(node):
+                path.append(i)
+                retval_.append(_recursion(item))
+                path.pop()
+            return retval_
         elif isinstance(node, dict):
-            return {
-                key: _recursion(value, [*keys, key])
-                for key, value in node.items()
-            }
-        elif type(node) in _SUPERJSON_FORMATTERS:
+            retval_ = {}
+            for key, value in node.items():
+                path.append(key)
+                retval_[key] = _recursion(value)
+                path.pop()
+            return retval_
+        elif type(node) is _JsUndefined or type(node) is datetime.datetime:
+            # identity checks are cheaper than hashing every scalar into the dict, which stays the source of truth
             _type_name, _type_formatter = _SUPERJSON_FORMATTERS[type(node)]
             nonlocal meta
-            if keys:
-                meta['.'.join(map(str, keys))] = [_type_name]
+            if path:
+                meta['.'.join(map(str, path))] = [_type_name]
             else:
                 meta = [_type_name]
             return _type_formatter(node)
         else:
             return node
 
-    retval = _recursion(native, [])
+    retval = _recursion(native)
 
     if meta:
         return {'json': retval, 'meta': {'values': meta}}
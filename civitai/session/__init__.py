@@ -1,4 +1,4 @@
-from .browser import CivitAIBrowser, get_civitai_cookies
+from .browser import CivitAIBrowser, get_civitai_cookies, from_local_browser, get_civitai_cookies_from_local
 from .config import CIVITAI_ROOT
-from .session import load_civitai_session
+from .session import load_civitai_session, mount_civitai_adapter, has_civitai_adapter, CIVITAI_ADAPTER_PREFIX
 from .whoami import WhoAmI, get_whoami_by_raw_user_info
@@ -3,8 +3,8 @@ from functools import partial
 
 import click
 
-from .browser import get_civitai_cookies
-from ..utils import GLOBAL_CONTEXT_SETTINGS, save_cookies, push_cookies_to_hf, get_hf_fs
+from .browser import get_civitai_cookies, get_civitai_cookies_from_local
+from ..utils import GLOBAL_CONTEXT_SETTINGS, save_cookies, push_cookies_to_hf
 from ..utils import print_version as _origin_print_version
 
 print_version = partial(_origin_print_version, 'civitai')
@@ -35,6 +35,26 @@ def login(output_file: str, timeout: int):
     logging.info(f'The cookies file is saved as {output_file!r}.')
 
 
+@cli.command('login_local', context_settings={**GLOBAL_CONTEXT_SETTINGS},
+             help='Reuse the civitai login of local browser and save the cookies file. '
+                  'Selenium login is used when the local browser is not logged in.')
+@click.option('-o', '--output_file', 'output_file', type=str, required=True,
+              help='Where to save the cookies file.', show_default=True)
+@click.option('-b', '--browser', 'browser', type=click.Choice(['chrome', 'firefox']), default='chrome',
+              help='Local browser to read the cookies from.', show_default=True)
+@click.option('-T', '--timeout', 'timeout', type=int, default=120,
+              help='Default timeout of login.', show_default=True)
+def login_local(output_file: str, browser: str, timeout: int):
+    logging.basicConfig(level=logging.INFO)
+    cookies, raw_user_info = get_civitai_cookies_from_local(browser, timeout)
+    save_cookies(
+        cookies=cookies,
+        raw_user_info=raw_user_info,
+        file=output_file,
+    )
+    logging.info(f'The cookies file is saved as {output_file!r}.')
+
+
 @cli.command('login_hf', context_settings={**GLOBAL_CONTEXT_SETTINGS},
              help='Login civitai and push the cookies file to huggingface private repository.')
 @click.option('-T', '--timeout', 'timeout', type=int, default=120,
@@ -45,17 +65,17 @@ def login_hf(timeout: int, repository: str):
     logging.basicConfig(level=logging.INFO)
     logging.info(f'Preparing cookie files.')
     cookies, raw_user_info = get_civitai_cookies(timeout)
-    push_cookies_to_hf(
+    # upload_file raises if the commit fails, no need to check the remote file again
+    # the file url on older huggingface_hub, CommitInfo (a str of the commit url) on newer ones
+    upload_url = push_cookies_to_hf(
         cookies=cookies,
         raw_user_info=raw_user_info,
         repository=repository,
         file='civitai_cookies.json',
     )
+    logging.info(f'Cookies uploaded, see {str(upload_url)!r}.')
 
     remote_file = f'datasets/{repository}/civitai_cookies.json'
-    hf_fs = get_hf_fs()
-    assert hf_fs.exists(remote_file), (f'Remote file {remote_file!r} not found, some error occurred. '
-                                       f'Please notify the developer.')
     logging.info(f'Cookie file saved to {remote_file!r}, you can use this string to load the civitai session.')
 
 
@@ -1,12 +1,17 @@
 from __future__ import annotations
 
+import atexit
 import logging
 import random
+import threading
 import time
-from typing import Any, Mapping, Tuple
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Any, Mapping, Tuple, Dict, Optional, Literal
 from urllib.parse import quote
 from urllib.request import getproxies
 
+import requests
 from hbutils.string import plural_word
 from hbutils.system import urlsplit
 
@@ -14,100 +19,183 @@ from .config import CIVITAI_ROOT
 
 try:
     from selenium import webdriver
+    from selenium.common.exceptions import TimeoutException
     from selenium.webdriver.common.desired_capabilities import DesiredCapabilities
+    from selenium.webdriver.support.ui import WebDriverWait
     from webdriver_manager.chrome import ChromeDriverManager
 except (ModuleNotFoundError, ImportError):
     _has_selenium = False
 else:
     _has_selenium = True
 
+try:
+    import browser_cookie3
+except (ModuleNotFoundError, ImportError):
+    _has_browser_cookie3 = False
+else:
+    _has_browser_cookie3 = True
+
 USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 " \
              "(KHTML, like Gecko) Chrome/101.0.4951.54 Safari/537.36"
-PROXIES = getproxies()
+_CIVITAI_HOST = urlsplit(CIVITAI_ROOT).host
+_REDIRECT_URL = f'{CIVITAI_ROOT}/'
+_LOGIN_URL = f'{CIVITAI_ROOT}/login?returnUrl={quote(_REDIRECT_URL)}'
+_SESSION_TOKEN_COOKIE = '__Secure-next-auth.session-token'
+_NEXT_DATA_SCRIPT = "var e = document.getElementById('__NEXT_DATA__'); return e ? e.textContent : null;"
+
+
+@lru_cache()
+def _get_driver_path() -> str:
+    # resolving the driver may check its version online, once per process is enough
+    return ChromeDriverManager().install()
 
 
 class CivitAIBrowser:
-    def __init__(self, headless: bool = False):
+    _pool: Dict[bool, 'CivitAIBrowser'] = {}
+    _pool_lock = threading.Lock()
+
+    def __init__(self, headless: bool = False, enable_perf_logs: bool = False):
         if not _has_selenium:
             raise SystemError('Selenium or webdriver_manager not installed. '
                               'Please install them with requirements-selenium.txt')
 
         self.caps = DesiredCapabilities.CHROME.copy()
-        self.caps["goog:loggingPrefs"] = {
-            "performance": "ALL"
-        }  # enable performance logs
+        if enable_perf_logs:
+            # chrome buffers every devtools event for these logs, only turn it on when they are read
+            self.caps["goog:loggingPrefs"] = {
+                "performance": "ALL"
+            }
 
         self.__browser = webdriver.Chrome(
-            executable_path=ChromeDriverManager().install(),
+            executable_path=_get_driver_path(),
             options=self.__get_chrome_option(headless=headless),
             desired_capabilities=self.caps,
         )
         self.__closed = False
+        self.__quitted = False
 
     @staticmethod
     def __get_chrome_option(headless: bool):
         options = webdriver.ChromeOptions()
 
         if headless:
-            options.add_argument("--headless")
+            options.add_argument("--headless=new")
             options.add_argument("--disable-gpu")
+            options.add_argument("--use-gl=angle")
+            options.add_argument("--enable-unsafe-swiftshader")
             options.add_argument("--disable-extensions")
             options.add_argument("--disable-infobars")
             options.add_argument("--disable-dev-shm-usage")
             options.add_argument("--disable-browser-side-navigation")
             options.add_argument("--start-maximized")
             options.add_argument("--no-sandbox")
-            options.add_argument("--disable-dev-shm-usage")
-            options.add_argument("--user-agent=" + USER_AGENT)
-            options.add_experimental_option("excludeSwitches", ["enable-automation"])
-            options.add_experimental_option("useAutomationExtension", False)
-
-        if "all" in PROXIES:
-            options.add_argument(f"--proxy-server={PROXIES['all']}")
-        elif "https" in PROXIES:
-            options.add_argument(f"--proxy-server={PROXIES['https']}")
-        elif "http" in PROXIES:
-            options.add_argument(f"--proxy-server={PROXIES['http']}")
+            # nobody looks at a headless page, so skip image loading entirely
+            options.add_argument("--blink-settings=imagesEnabled=false")
+
+        options.add_argument("--disable-features=Translate,BackForwardCache,OptimizationHints")
+        options.add_argument("--user-agent=" + USER_AGENT)
+        options.add_experimental_option("excludeSwitches", ["enable-automation"])
+        options.add_experimental_option("useAutomationExtension", False)
+
+        # read when the browser is created, so proxy variables set after import still apply
+        proxies = getproxies()
+        if "all" in proxies:
+            options.add_argument(f"--proxy-server={proxies['all']}")
+        elif "https" in proxies:
+            options.add_argument(f"--proxy-server={proxies['https']}")
+        elif "http" in proxies:
+            options.add_argument(f"--proxy-server={proxies['http']}")
         else:
             options.add_argument('--proxy-server="direct://"')
             options.add_argument("--proxy-bypass-list=*")
 
         return options
 
+    @property
+    def closed(self) -> bool:
+        return self.__closed
+
     def close(self):
         if not self.__closed:
             self.__browser.close()
             self.__closed = True
 
-    def get_civitai_cookie(self, timeout: int = 120):
-        from .whoami import _get_whoami_by_page_source
+    def quit(self):
+        # also after close(), which only closes the window and leaves chromedriver running
+        if not self.__quitted:
+            self.__browser.quit()
+            self.__closed = self.__quitted = True
+
+    @classmethod
+    @contextmanager
+    def borrow(cls, headless: bool = False):
+        # starting chrome takes seconds, so an idle browser is kept for the next login in this process
+        with cls._pool_lock:
+            browser = cls._pool.pop(headless, None)
+        if browser is None or browser.closed:
+            browser = cls(headless=headless)
+
+        try:
+            yield browser
+        except BaseException:
+            # the driver may be dead (e.g. window closed by the user), never hand it out again
+            try:
+                browser.quit()
+            except Exception as err:
+                logging.warning(f'Failed to quit browser: {err!r}')
+            raise
+
+        if browser.closed:
+            browser.quit()
+        else:
+            with cls._pool_lock:
+                browser, cls._pool[headless] = cls._pool.get(headless), browser
+            if browser is not None:
+                browser.quit()
 
-        redirect_url = f'{CIVITAI_ROOT}/'
-        login_url = f'{CIVITAI_ROOT}/login?returnUrl={quote(redirect_url)}'
+    @classmethod
+    def _shutdown_pool(cls):
+        with cls._pool_lock:
+            browsers, cls._pool = list(cls._pool.values()), {}
+        for browser in browsers:
+            browser.quit()
 
-        self.__browser.get(login_url)
+    def get_civitai_cookie(self, timeout: int = 120):
+        from .whoami import _get_whoami_by_next_data
+
+        self.__browser.get(_LOGIN_URL)
         logging.info(f'Please login civitai within {plural_word(timeout, "second")}.')
 
-        for _ in range(timeout):
-            logging.info(f'Current url of browser: {self.__browser.current_url!r}')
+        last_next_data, last_whoami = None, None
 
-            if urlsplit(self.__browser.current_url).host == urlsplit(CIVITAI_ROOT).host:
-                _whoami = _get_whoami_by_page_source(self.__browser.page_source)
-                if _whoami is not None:
-                    logging.info(f'Login success! '
-                                 f'Hello, @{_whoami.username} (ID: {_whoami.id}, email: {_whoami.email})!')
-                    break
-            time.sleep(1.0)
-        else:
-            self.close()
+        def _logged_in(driver):
+            nonlocal last_next_data, last_whoami
+            current_url = driver.current_url
+            logging.debug(f'Current url of browser: {current_url!r}')
+            if urlsplit(current_url).host != _CIVITAI_HOST:
+                return None
+
+            # only the next.js payload is needed, not the whole serialized page
+            next_data = driver.execute_script(_NEXT_DATA_SCRIPT)
+            if not next_data:
+                return None
+            elif next_data != last_next_data:  # unchanged page between polls, no need to parse it again
+                last_next_data, last_whoami = next_data, _get_whoami_by_next_data(next_data)
+            return last_whoami
+
+        try:
+            _whoami = WebDriverWait(self.__browser, timeout, poll_frequency=0.5).until(_logged_in)
+        except TimeoutException:
+            self.quit()
             raise ValueError(f'Login timeout, {plural_word(timeout, "second")} exceed.')
+        logging.info(f'Login success! '
+                     f'Hello, @{_whoami.username} (ID: {_whoami.id}, email: {_whoami.email})!')
 
-        items = sorted([
+        cookies = dict(sorted(
             (item['name'], item['value'])
             for item in self.__browser.get_cookies()
             # if item['domain'].endswith('civitai.com')
-        ])
-        cookies = {key: value for key, value in items}
+        ))
         return cookies, _whoami.raw
 
     @staticmethod
@@ -125,5 +213,67 @@ class CivitAIBrowser:
             elm.send_keys(text)
 
 
+atexit.register(CivitAIBrowser._shutdown_pool)
+
+
 def get_civitai_cookies(login_timeout: int = 120) -> Tuple[Mapping[str, str], Mapping[str, Any]]:
-    return CivitAIBrowser().get_civitai_cookie(timeout=login_timeout)
+    with CivitAIBrowser.borrow() as browser:
+        return browser.get_civitai_cookie(timeout=login_timeout)
+
+
+def from_local_browser(browser: Literal['chrome', 'firefox'] = 'chrome', timeout: int = 30) \
+        -> Optional[Tuple[Mapping[str, str], Mapping[str, Any]]]:
+    """
+    Reuse the civitai login of a local chrome or firefox profile, without starting selenium.
+
+    :param browser: Local browser to read the cookies from, ``chrome`` or ``firefox``.
+    :param timeout: Timeout of the request to civitai.
+    :return: Cookies and raw user info, ``None`` when the local profile is not logged in.
+    """
+    if not _has_browser_cookie3:
+        raise SystemError('browser_cookie3 not installed. '
+                          'Please install it with requirements-local.txt')
+    from .whoami import _get_whoami_by_page_source
+
+    if browser == 'chrome':
+        loader = browser_cookie3.chrome
+    elif browser == 'firefox':
+        loader = browser_cookie3.firefox
+    else:
+        raise ValueError(f'Unsupported local browser - {browser!r}.')
+    try:
+        jar = loader(domain_name=_CIVITAI_HOST)
+    except browser_cookie3.BrowserCookieError as err:  # no profile, or the cookie database is locked
+        logging.warning(f'Unable to read cookies from local {browser}: {err!r}')
+        return None
+    if not any(cookie.name == _SESSION_TOKEN_COOKIE for cookie in jar):
+        logging.info(f'No civitai session found in local {browser}.')
+        return None
+
+    # a dedicated session, so the login cookies do not leak into the shared one
+    with requests.Session() as session:
+        session.cookies.update(jar)
+        try:
+            resp = session.get(CIVITAI_ROOT, headers={'User-Agent': USER_AGENT}, timeout=timeout)
+            resp.raise_for_status()
+        except requests.RequestException as err:  # e.g. cloudflare challenge, network errors
+            logging.warning(f'Unable to check the civitai session of local {browser}: {err!r}')
+            return None
+        try:
+            _whoami = _get_whoami_by_page_source(resp.text)
+        except (AttributeError, KeyError, ValueError):  # no usable __NEXT_DATA__ in the page
+            _whoami = None
+        if not _whoami:
+            logging.info(f'Civitai session in local {browser} is not valid.')
+            return None
+
+        logging.info(f'Login success! '
+                     f'Hello, @{_whoami.username} (ID: {_whoami.id}, email: {_whoami.email})!')
+        # cookies refreshed by civitai in the response are included as well
+        cookies = dict(sorted((cookie.name, cookie.value) for cookie in session.cookies))
+        return cookies, _whoami.raw
+
+
+def get_civitai_cookies_from_local(browser: Literal['chrome', 'firefox'] = 'chrome', login_timeout: int = 120) \
+        -> Tuple[Mapping[str, str], Mapping[str, Any]]:
+    return from_local_browser(browser) or get_civitai_cookies(login_timeout)
@@ -1,16 +1,41 @@
 from typing import Mapping, Optional, Any, Tuple
 
 import requests
+from requests.adapters import Retry
 
 from .config import CIVITAI_ROOT
-from ..utils import get_session, load_cookies, CookiesTyping
+from ..utils import get_session, load_cookies, CookiesTyping, get_pooled_adapter
+
+# the session is shared with huggingface and the upload hosts, only civitai should receive these
+_CIVITAI_HEADERS = {'Referer': CIVITAI_ROOT}
+
+
+# requests picks adapters by plain string prefix, without the slash civitai.community would be matched as well
+CIVITAI_ADAPTER_PREFIX = f'{CIVITAI_ROOT}/'
+
+
+def has_civitai_adapter(session: requests.Session) -> bool:
+    # adapters mounted by the caller at the bare root count as well
+    return CIVITAI_ADAPTER_PREFIX in session.adapters or CIVITAI_ROOT in session.adapters
+
+
+def mount_civitai_adapter(session: requests.Session) -> requests.Session:
+    # the iterators make lots of small requests, keep their connections alive,
+    # adapters mounted by the caller are left untouched
+    if not has_civitai_adapter(session):
+        # posts (model.upsert, post.addImage, ...) are only retried on 429, which civitai has not processed
+        session.mount(CIVITAI_ADAPTER_PREFIX, get_pooled_adapter(
+            pool_size=32, max_retries=3, backoff_factor=0.3,
+            status_forcelist=(429, 500, 502, 503, 504), allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+            headers=_CIVITAI_HEADERS, retry_rate_limited=True,
+        ))
+    return session
 
 
 def _get_civitai_session_from_cookies(cookies: Mapping[str, str]) -> requests.Session:
     session = get_session()
     session.cookies.update(cookies)
-    session.headers.update({'Referer': CIVITAI_ROOT})
-    return session
+    return mount_civitai_adapter(session)
 
 
 def load_civitai_session(anything: Optional[CookiesTyping] = None) \
@@ -1,11 +1,9 @@
-import copy
 import datetime
-import json
+import re
 from dataclasses import dataclass, field
 from typing import Optional, Dict, Any, Mapping
 
-import dateparser
-from pyquery import PyQuery as pq
+from ..utils import json_loads, parse_time_text
 
 
 @dataclass
@@ -19,9 +17,16 @@ class WhoAmI:
     raw: Dict[str, Any] = field(repr=False, default_factory=dict)
 
 
+_NEXT_DATA_PATTERN = re.compile(r'<script[^>]*\bid=["\']__NEXT_DATA__["\'][^>]*>(.*?)</script>', re.DOTALL)
+
+
 def _get_whoami_by_page_source(page_source: str) -> Optional[WhoAmI]:
-    metadata_text = pq(page_source)('script#__NEXT_DATA__').text()
-    metadata_json = json.loads(metadata_text)
+    # script contents are raw text in html, so no dom parsing or unescaping is needed to get the payload
+    return _get_whoami_by_next_data(_NEXT_DATA_PATTERN.search(page_source).group(1))
+
+
+def _get_whoami_by_next_data(metadata_text: str) -> Optional[WhoAmI]:
+    metadata_json = json_loads(metadata_text)
     session_json = metadata_json["props"]["pageProps"]["session"]
     if session_json:
         user_json = session_json['user']
@@ -38,8 +43,8 @@ def get_whoami_by_raw_user_info(raw_user_info: Optional[Mapping[str, Any]]) -> O
             username=raw_user_info['username'],
             email=raw_user_info['email'],
             icon_image_url=raw_user_info.get('image'),
-            created_at=dateparser.parse(raw_user_info['createdAt']),
-            raw=copy.deepcopy(dict(raw_user_info or {})),
+            created_at=parse_time_text(raw_user_info['createdAt']),
+            raw=dict(raw_user_info),  # shallow, user info always comes freshly decoded from json
         )
     else:
         return None
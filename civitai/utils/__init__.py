@@ -1,5 +1,7 @@
+from .cache import LRUCache
 from .cli import GLOBAL_CONTEXT_SETTINGS, print_version
 from .cookies import encode_cookies, decode_cookies, load_cookies, save_cookies, push_cookies_to_hf, CookiesTyping
 from .huggingface import number_to_tag, get_hf_fs, get_hf_client
-from .session import configure_http_backend, get_session
-from .time import parse_time, parse_publish_at
+from .json import json_loads, json_dumps, json_dumpb
+from .session import configure_http_backend, get_session, get_shared_session, get_cached_session, get_pooled_adapter
+from .time import parse_time, parse_time_text, parse_publish_at
@@ -2,46 +2,85 @@ import collections.abc
 import json
 import os.path
 import pickle
+import re
 import warnings
-from binascii import Error
+import zlib
+from functools import lru_cache
 from typing import Mapping, Union, Any
 
 from hbutils.encoding import base64_encode, base64_decode
-from hbutils.system import TemporaryDirectory
 
 from .huggingface import get_hf_fs, get_hf_client
+from .json import json_loads, json_dumpb
 
 
 def encode_cookies(cookies: Mapping[str, str]) -> str:
-    return base64_encode(pickle.dumps(cookies), urlsafe=True)
+    data = json.dumps(dict(cookies), separators=(',', ':')).encode('utf-8')
+    return base64_encode(zlib.compress(data), urlsafe=True)
+
+
+# unpickling can run arbitrary code, so cookie strings of older versions are only loaded when this is set
+UNSAFE_PICKLE_ENV = 'CIVITAI_UNSAFE_PICKLE_COOKIES'
 
 
 def decode_cookies(b64: str) -> Mapping[str, str]:
-    return pickle.loads(base64_decode(b64, urlsafe=True))
+    data = base64_decode(b64, urlsafe=True)
+    try:
+        return json.loads(zlib.decompress(data))
+    except zlib.error:  # encoded by older versions, which pickled the cookies
+        if os.environ.get(UNSAFE_PICKLE_ENV, '').lower() in ('1', 'true', 'yes'):
+            return pickle.loads(data)
+        raise ValueError(f'Not a zlib-compressed cookie string, pickled cookies of older versions '
+                         f'are only loaded when {UNSAFE_PICKLE_ENV}=1 is set.')
+
+
+@lru_cache()
+def _hf_fs():
+    return get_hf_fs()
 
 
-hf_fs = get_hf_fs()
-hf_client = get_hf_client()
+@lru_cache()
+def _hf_client():
+    return get_hf_client()
+
+
+def __getattr__(name):
+    # hf_fs and hf_client used to be created on import, keep them reachable but build them on first use
+    if name == 'hf_fs':
+        return _hf_fs()
+    elif name == 'hf_client':
+        return _hf_client()
+    else:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
 
 CookiesTyping = Union[str, Mapping[str, str]]
+_B64_PATTERN = re.compile(r'[A-Za-z0-9_\-]+=*')
 
 
 def _load_raw_cookies(anything: CookiesTyping):
     if isinstance(anything, str) and os.path.exists(anything):
-        with open(anything, 'r', encoding='utf-8') as f:
-            return json.load(f)
+        with open(anything, 'rb') as f:
+            return json_loads(f.read())
     elif isinstance(anything, collections.abc.Mapping):
         return anything
     elif isinstance(anything, str):
-        try:
-            return decode_cookies(anything)
-        except (Error, pickle.UnpicklingError):
+        # hf paths contain slashes, so only strings in the urlsafe base64 alphabet are worth decoding
+        if _B64_PATTERN.fullmatch(anything):
             try:
-                if hf_fs.exists(anything):
-                    return json.loads(hf_fs.read_text(anything))
-            except NotImplementedError:
+                return decode_cookies(anything)
+            except Exception:  # random strings fail in all kinds of ways, try it as a hf path then
                 pass
 
+        try:
+            hf_fs = _hf_fs()
+            if hf_fs.exists(anything):
+                # orjson parses the raw bytes, no need to decode them to text first
+                with hf_fs.open(anything, 'rb') as f:
+                    return json_loads(f.read())
+        except NotImplementedError:
+            pass
+
     raise TypeError(f'Unknown cookie type - {anything!r}.')
 
 
@@ -53,34 +92,33 @@ def load_cookies(anything: CookiesTyping):
         return raw, None
 
 
+def _dump_cookies(cookies: Mapping[str, str], raw_user_info: Mapping[str, Any]) -> bytes:
+    return json_dumpb({
+        'cookies': dict(cookies),
+        'raw_user_info': raw_user_info,
+    }, sort_keys=True)
+
+
 def save_cookies(cookies: Mapping[str, str], raw_user_info: Mapping[str, Any], file: str):
-    with open(file, 'w', encoding='utf-8') as f:
-        json.dump({
-            'cookies': cookies,
-            'raw_user_info': raw_user_info,
-        }, f, ensure_ascii=False, indent=4, sort_keys=True)
+    with open(file, 'wb') as f:
+        f.write(_dump_cookies(cookies, raw_user_info))
 
 
 def push_cookies_to_hf(cookies: Mapping[str, str], raw_user_info: Mapping[str, Any],
                        repository: str, file: str = 'civitai_cookies.json',
                        revision: str = 'main', repo_type: str = 'dataset', public: bool = False):
+    hf_client = _hf_client()
     hf_client.create_repo(repo_id=repository, repo_type=repo_type, private=not public, exist_ok=True)
     if not hf_client.repo_info(repo_id=repository, repo_type=repo_type).private:
         warnings.warn('Cookies is sensitive information for your civitai account. '
                       'Push it to public repository is dangerous. '
                       'We strongly recommend you to push it to your private repository.')
-    with TemporaryDirectory() as td:
-        cookie_file = os.path.join(td, 'cookies.json')
-        save_cookies(
-            cookies=cookies,
-            raw_user_info=raw_user_info,
-            file=cookie_file
-        )
-        hf_client.upload_file(
-            path_or_fileobj=cookie_file,
-            path_in_repo=file,
-            repo_id=repository,
-            repo_type=repo_type,
-            revision=revision,
-            commit_message=f'Publish civitai cookies to {file!r}'
-        )
+    # uploaded straight from memory
+    return hf_client.upload_file(
+        path_or_fileobj=_dump_cookies(cookies, raw_user_info),
+        path_in_repo=file,
+        repo_id=repository,
+        repo_type=repo_type,
+        revision=revision,
+        commit_message=f'Publish civitai cookies to {file!r}'
+    )
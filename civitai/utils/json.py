@@ -0,0 +1,28 @@
+import json
+from typing import Any, Union
+
+try:
+    import orjson
+except (ImportError, ModuleNotFoundError):
+    orjson = None
+
+
+def json_loads(data: Union[str, bytes, bytearray]) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    else:
+        return json.loads(data)
+
+
+def json_dumps(obj: Any, sort_keys: bool = False) -> str:
+    return json_dumpb(obj, sort_keys=sort_keys).decode('utf-8')
+
+
+def json_dumpb(obj: Any, sort_keys: bool = False) -> bytes:
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, option=option)
+    else:
+        return json.dumps(obj, ensure_ascii=False, sort_keys=sort_keys, separators=(',', ':')).encode('utf-8')
@@ -1,10 +1,18 @@
+import datetime
 import threading
 from functools import lru_cache
-from typing import Callable, Optional, Dict
+from typing import Callable, Optional, Dict, Collection, Mapping
 
 import requests
 from requests.adapters import HTTPAdapter, Retry
 
+try:
+    import requests_cache
+except (ModuleNotFoundError, ImportError):
+    _has_requests_cache = False
+else:
+    _has_requests_cache = True
+
 DEFAULT_TIMEOUT = 10  # seconds
 
 BACKEND_FACTORY_T = Callable[[], requests.Session]
@@ -42,9 +50,11 @@ def configure_http_backend(backend_factory: BACKEND_FACTORY_T = requests.Session
     session = get_session()
     ```
     """
-    global _GLOBAL_BACKEND_FACTORY
+    global _GLOBAL_BACKEND_FACTORY, _SHARED_SESSION
     _GLOBAL_BACKEND_FACTORY = backend_factory
     _get_session_from_cache.cache_clear()
+    with _SHARED_SESSION_LOCK:
+        _SHARED_SESSION = None
 
 
 def get_session() -> requests.Session:
@@ -79,6 +89,25 @@ def get_session() -> requests.Session:
     return _get_session_from_cache(thread_ident=threading.get_ident())
 
 
+_SHARED_SESSION: Optional[requests.Session] = None
+_SHARED_SESSION_LOCK = threading.Lock()
+
+
+def get_shared_session() -> requests.Session:
+    """
+    Get a `requests.Session` object shared by all threads, created with the session factory from the user.
+
+    Unlike [`get_session`], this session is never handed to the login code, so no cookies or civitai headers are
+    put into it. It is meant for stateless requests (e.g. the public api) which can share one connection pool
+    between threads. A new one is created after [`configure_http_backend`] is called.
+    """
+    global _SHARED_SESSION
+    with _SHARED_SESSION_LOCK:
+        if _SHARED_SESSION is None:
+            _SHARED_SESSION = _GLOBAL_BACKEND_FACTORY()
+        return _SHARED_SESSION
+
+
 @lru_cache(maxsize=128)  # default value for Python>=3.8. Let's keep the same for Python3.7
 def _get_session_from_cache(thread_ident: int) -> requests.Session:
     """
@@ -108,6 +137,9 @@ class TimeoutHTTPAdapter(HTTPAdapter):
 
     :param timeout: The default timeout value in seconds. (default: 10)
     :type timeout: int
+    :param headers: Default headers of the requests sent through this adapter, only the hosts it is
+        mounted for will receive them. (default: None)
+    :type headers: Optional[Mapping[str, str]]
     """
 
     def __init__(self, *args, **kwargs):
@@ -115,11 +147,13 @@ class TimeoutHTTPAdapter(HTTPAdapter):
         if "timeout" in kwargs:
             self.timeout = kwargs["timeout"]
             del kwargs["timeout"]
+        self.headers = dict(kwargs.pop("headers", None) or {})
         super().__init__(*args, **kwargs)
 
     def send(self, request, **kwargs):
         """
-        Sends a request with the provided timeout value.
+        Sends a request with the provided timeout value, and the default headers which are not set
+        in the request.
 
         :param request: The request to send.
         :type request: PreparedRequest
@@ -131,9 +165,62 @@ class TimeoutHTTPAdapter(HTTPAdapter):
         timeout = kwargs.get("timeout")
         if timeout is None:
             kwargs["timeout"] = self.timeout
+        for key, value in self.headers.items():
+            request.headers.setdefault(key, value)
         return super().send(request, **kwargs)
 
 
+class _RateLimitRetry(Retry):
+    # a 429 response means the request was not processed, so it is safe to retry with any method
+    def is_retry(self, method: str, status_code: int, has_retry_after: bool = False) -> bool:
+        if status_code == 429 and self.total:
+            return True
+        return super().is_retry(method, status_code, has_retry_after)
+
+
+_RETRY_STATUSES = (413, 429, 500, 501, 502, 503, 504, 505, 506, 507, 509, 510, 511)
+_RETRY_METHODS = ("HEAD", "GET", "POST", "PUT", "DELETE", "OPTIONS", "TRACE")
+
+
+def get_pooled_adapter(pool_size: int = 32, max_retries: int = 5, backoff_factor: float = 1.0,
+                       status_forcelist: Collection[int] = _RETRY_STATUSES,
+                       allowed_methods: Collection[str] = _RETRY_METHODS,
+                       timeout: int = DEFAULT_TIMEOUT,
+                       headers: Optional[Mapping[str, str]] = None,
+                       retry_rate_limited: bool = False) -> TimeoutHTTPAdapter:
+    """
+    Returns an HTTP adapter with retry and timeout settings, which keeps up to ``pool_size`` keep-alive
+    connections per host.
+
+    :param pool_size: Number of pooled connections per host, and number of pooled hosts. (default: 32)
+    :type pool_size: int
+    :param max_retries: The maximum number of retries. (default: 5)
+    :type max_retries: int
+    :param backoff_factor: Backoff factor between the retries. (default: 1.0)
+    :type backoff_factor: float
+    :param status_forcelist: Status codes to retry on.
+    :type status_forcelist: Collection[int]
+    :param allowed_methods: HTTP methods which can be retried.
+    :type allowed_methods: Collection[str]
+    :param timeout: The default timeout value in seconds. (default: 10)
+    :type timeout: int
+    :param headers: Default headers of the requests sent through the adapter. (default: None)
+    :type headers: Optional[Mapping[str, str]]
+    :param retry_rate_limited: Retry 429 responses of all methods, including the ones not in ``allowed_methods``,
+        since the server did not process them. (default: False)
+    :type retry_rate_limited: bool
+    :returns: The HTTP adapter.
+    :rtype: TimeoutHTTPAdapter
+    """
+    retries = (_RateLimitRetry if retry_rate_limited else Retry)(
+        total=max_retries, backoff_factor=backoff_factor,
+        status_forcelist=list(status_forcelist),
+        allowed_methods=frozenset(allowed_methods),
+    )
+    return TimeoutHTTPAdapter(max_retries=retries, timeout=timeout, headers=headers,
+                              pool_connections=pool_size, pool_maxsize=pool_size, pool_block=False)
+
+
 def _get_requests_session(max_retries: int = 5, timeout: int = DEFAULT_TIMEOUT,
                           headers: Optional[Dict[str, str]] = None, session: Optional[requests.Session] = None) \
         -> requests.Session:
@@ -152,12 +239,7 @@ def _get_requests_session(max_retries: int = 5, timeout: int = DEFAULT_TIMEOUT,
     :rtype: requests.Session
     """
     session = session or requests.session()
-    retries = Retry(
-        total=max_retries, backoff_factor=1,
-        status_forcelist=[413, 429, 500, 501, 502, 503, 504, 505, 506, 507, 509, 510, 511],
-        allowed_methods=["HEAD", "GET", "POST", "PUT", "DELETE", "OPTIONS", "TRACE"],
-    )
-    adapter = TimeoutHTTPAdapter(max_retries=retries, timeout=timeout, pool_connections=32, pool_maxsize=32)
+    adapter = get_pooled_adapter(max_retries=max_retries, timeout=timeout)
     session.mount('http://', adapter)
     session.mount('https://', adapter)
     session.headers.update({
@@ -169,4 +251,32 @@ def _get_requests_session(max_retries: int = 5, timeout: int = DEFAULT_TIMEOUT,
     return session
 
 
+def get_cached_session(cache_name: str = '.civitai_cache',
+                       expire_after: datetime.timedelta = datetime.timedelta(hours=6)) -> requests.Session:
+    """
+    Returns a requests Session object whose responses are cached on disk, with the same retry and timeout
+    settings as the default sessions. Cached responses are revalidated with ETag / Last-Modified and the
+    server's ``Cache-Control`` directives are respected.
+
+    :param cache_name: Path of the sqlite cache database. (default: ``.civitai_cache``)
+    :type cache_name: str
+    :param expire_after: Default lifetime of cached responses. (default: 6 hours)
+    :type expire_after: datetime.timedelta
+    :returns: The cached requests Session object.
+    :rtype: requests.Session
+    """
+    if not _has_requests_cache:
+        raise SystemError('requests-cache not installed. '
+                          'Please install it with requirements-cache.txt')
+
+    return _get_requests_session(session=requests_cache.CachedSession(
+        cache_name=cache_name,
+        backend='sqlite',
+        expire_after=expire_after,
+        allowable_codes=(200,),
+        stale_if_error=True,
+        cache_control=True,
+    ))
+
+
 configure_http_backend(_get_requests_session)
@@ -1,17 +1,26 @@
 import datetime
 from typing import Optional
 
-import dateparser
-
 try:
     from zoneinfo import ZoneInfo
 except (ImportError, ModuleNotFoundError):
     from backports.zoneinfo import ZoneInfo
 
+_UTC = ZoneInfo('UTC')
+
+
+def parse_time_text(text: str) -> Optional[datetime.datetime]:
+    # civitai sends iso-8601 everywhere, dateparser is only for other human-written formats
+    try:
+        return datetime.datetime.fromisoformat(text[:-1] + '+00:00' if text.endswith('Z') else text)
+    except ValueError:
+        import dateparser  # slow to import and to run
+        return dateparser.parse(text)
+
 
 def parse_time(time):
     if isinstance(time, str):
-        d = dateparser.parse(time)
+        d = parse_time_text(time)
     elif isinstance(time, (int, float)):
         d = datetime.datetime.fromtimestamp(time)
     elif isinstance(time, datetime.datetime):
@@ -28,6 +37,6 @@ def parse_time(time):
 def parse_publish_at(publish_at: Optional[str] = None) -> Optional[datetime.datetime]:
     if publish_at is not None:
         local_time = parse_time(publish_at)
-        publish_at = local_time.astimezone(ZoneInfo('UTC'))
+        publish_at = local_time.astimezone(_UTC)
 
     return publish_at